@@ -1,51 +1,61 @@
 import os
 import json
-import requests
+import time
 from dotenv import load_dotenv
-from azure.identity import DefaultAzureCredential
 
 load_dotenv()
 
-ENDPOINT = os.environ["AZURE_AI_ENDPOINT"].rstrip("/")
+from foundry import ENDPOINT, API_QS, THREADS_URL, get_headers, send_request
+
 AGENT_ID = os.environ["AZURE_AI_AGENT_ID"]
-API_VERSION = "v1"
 
 MCP_SERVER_URL = os.environ.get("MCP_SERVER_URL")
 MCP_SERVER_LABEL = os.environ.get("MCP_SERVER_LABEL")
 
+# Seconds to reuse a fetched agent definition before checking it again
+AGENT_CACHE_TTL = 60
+# agent_id -> (agent, etag, fetched_at)
+_agent_cache = {}
 
-def get_headers():
-    # Prefer Managed Identity / AAD
-    try:
-        token = DefaultAzureCredential().get_token("https://ai.azure.com/.default").token
-        return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    except Exception:
-        # Fallback to API key if provided
-        api_key = os.getenv("AZURE_AI_API_KEY")
-        if not api_key:
-            raise RuntimeError("No Azure auth available. Set AZURE_AI_API_KEY or enable Managed Identity.")
-        return {"api-key": api_key, "Content-Type": "application/json"}
+# Empty JSON body for thread creation, encoded once
+_THREAD_CREATE_BODY = b"{}"
 
 
 def get_agent():
-    url = f"{ENDPOINT}/assistants/{AGENT_ID}?api-version={API_VERSION}"
-    r = requests.get(url, headers=get_headers(), timeout=30)
-    r.raise_for_status()
-    return r.json()
+    cached = _agent_cache.get(AGENT_ID)
+    if cached and time.time() - cached[2] < AGENT_CACHE_TTL:
+        return cached[0]
+
+    url = f"{ENDPOINT}/assistants/{AGENT_ID}{API_QS}"
+    headers = get_headers()
+    if cached and cached[1]:
+        # Let the server answer 304 if the agent hasn't changed
+        headers = {**headers, "If-None-Match": cached[1]}
+    r = send_request("GET", url, headers=headers, timeout=30)
+    if r.status_code == 304 and cached:
+        agent = cached[0]
+    else:
+        r.raise_for_status()
+        agent = r.json()
+    etag = r.headers.get("ETag") or (cached[1] if cached else None)
+    _agent_cache[AGENT_ID] = (agent, etag, time.time())
+    return agent
 
 
 def update_agent_tools(tools):
-    url = f"{ENDPOINT}/assistants/{AGENT_ID}?api-version={API_VERSION}"
+    url = f"{ENDPOINT}/assistants/{AGENT_ID}{API_QS}"
     # Try partial update with tools only
     payload = {"tools": tools}
-    r = requests.post(url, headers=get_headers(), json=payload, timeout=30)
+    r = send_request("POST", url, headers=get_headers(), json=payload, timeout=30)
     r.raise_for_status()
+    _agent_cache.pop(AGENT_ID, None)
     return r.json()
 
 
 def ensure_learn_mcp_tool():
     agent = get_agent()
-    tools = agent.get("tools", []) or []
+    # Copy so appending below doesn't modify the cached agent
+    tools = list(agent.get("tools", []) or [])
 
     # Check if MCP tool with our label already exists
     for t in tools:
@@ -68,49 +78,44 @@ def ensure_learn_mcp_tool():
 
 
 def create_thread():
-    url = f"{ENDPOINT}/threads?api-version={API_VERSION}"
-    r = requests.post(url, headers=get_headers(), json={}, timeout=30)
+    url = THREADS_URL + API_QS
+    r = send_request("POST", url, headers=get_headers(), content=_THREAD_CREATE_BODY, timeout=30)
     r.raise_for_status()
     return r.json()['id']
 
 
 def create_run(thread_id, message):
-    url = f"{ENDPOINT}/threads/{thread_id}/messages?api-version={API_VERSION}"
-    message_data = {"role": "user", "content": message}
-    r = requests.post(url, headers=get_headers(), json=message_data, timeout=30)
-    r.raise_for_status()
-    
-    run_url = f"{ENDPOINT}/threads/{thread_id}/runs?api-version={API_VERSION}"
-    run_data = {"assistant_id": AGENT_ID}
-    r = requests.post(run_url, headers=get_headers(), json=run_data, timeout=30)
+    # The user message rides along with run creation instead of a separate POST
+    run_url = f"{THREADS_URL}/{thread_id}/runs{API_QS}"
+    run_data = {
+        "assistant_id": AGENT_ID,
+        "additional_messages": [{"role": "user", "content": message}],
+    }
+    r = send_request("POST", run_url, headers=get_headers(), json=run_data, timeout=30)
     r.raise_for_status()
     return r.json()['id']
 
 
 def poll_run(thread_id, run_id):
-    url = f"{ENDPOINT}/threads/{thread_id}/runs/{run_id}?api-version={API_VERSION}"
-    r = requests.get(url, headers=get_headers(), timeout=30)
+    url = f"{THREADS_URL}/{thread_id}/runs/{run_id}{API_QS}"
+    r = send_request("GET", url, headers=get_headers(), timeout=30)
     r.raise_for_status()
     return r.json()
 
 
 def approve_pending_tool_calls(thread_id, run_id, required_action):
     details = required_action.get("submit_tool_outputs") or required_action.get("submit_tool_approval") or {}
-    calls = details.get("tool_calls", [])
-    if not calls:
+    tool_approvals = [
+        # add any required headers for your MCP server here
+        {"tool_call_id": tc["id"], "approve": True, "headers": {}}
+        for tc in details.get("tool_calls", [])
+        if tc.get("type") == "mcp"
+    ]
+    if not tool_approvals:
         return False
 
-    tool_approvals = []
-    for tc in calls:
-        if tc.get("type") == "mcp":
-            tool_approvals.append({
-                "tool_call_id": tc["id"],
-                "approve": True,
-                "headers": {}  # add any required headers for your MCP server here
-            })
-
-    url = f"{ENDPOINT}/threads/{thread_id}/runs/{run_id}/submit_tool_outputs?api-version={API_VERSION}"
-    r = requests.post(url, headers=get_headers(), json={"tool_approvals": tool_approvals}, timeout=30)
+    url = f"{THREADS_URL}/{thread_id}/runs/{run_id}/submit_tool_outputs{API_QS}"
+    r = send_request("POST", url, headers=get_headers(), json={"tool_approvals": tool_approvals}, timeout=30)
     r.raise_for_status()
     return True
 
@@ -127,7 +132,6 @@ def test_mcp_functionality():
     print(f"Created test run: {run_id}")
     
     # Poll for completion
-    import time
     for _ in range(30):
         run = poll_run(thread_id, run_id)
         status = run['status']
@@ -0,0 +1,603 @@
+"""
+Shared Azure AI Foundry plumbing for the chat apps and the setup script:
+authenticated HTTP calls to the Agents API, streamed runs, and the chat routes
+"""
+
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import orjson
+from cachetools import TTLCache
+from flask import Flask, Response, current_app, request, jsonify, send_from_directory, session, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_cors import CORS
+from flask_sock import Sock
+from itsdangerous import BadSignature, URLSafeSerializer
+
+# Load environment variables from .env outside production
+if os.getenv('ENV') != 'prod':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Azure AI Configuration
+ENDPOINT = os.environ["AZURE_AI_ENDPOINT"].rstrip("/")
+API_VERSION = "v1"
+
+# URL pieces that never change, built once at import
+THREADS_URL = f"{ENDPOINT}/threads"
+API_QS = f"?api-version={API_VERSION}"
+
+POLL_TIMEOUT = 60  # seconds to wait for a run to finish
+MAX_RETRIES = 3  # retries for transient failures on each outbound call
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Only these mean a POST was turned away before taking effect, so it's safe to send again
+POST_RETRYABLE_STATUS = {429, 503}
+
+# Chat turns run on background threads; each job's events are queued until the client reads them
+# Jobs live in this process's memory, so /events must reach the worker that took /chat (see gunicorn.conf.py)
+JOB_TTL = 300  # seconds before an unread job is discarded
+_pool = ThreadPoolExecutor(16)
+_jobs = {}  # job_id -> (queue of chat events, created_at)
+
+# Replies to conversation-opening questions, reused for repeats of the same question
+_reply_cache = TTLCache(maxsize=1024, ttl=600)
+_reply_cache_lock = threading.Lock()  # TTLCache isn't thread-safe
+
+# Empty JSON body for thread creation, encoded once
+_THREAD_CREATE_BODY = b"{}"
+
+# Shared HTTP/2 client so concurrent calls to the endpoint multiplex over one connection
+_client = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=32), timeout=30)
+
+TOKEN_SCOPE = "https://ai.azure.com/.default"
+TOKEN_REFRESH_MARGIN = 300  # seconds before expiry to fetch a fresh token
+_credential = None  # created on first use; importing azure.identity pulls in MSAL
+_token_lock = threading.Lock()
+_token_cache = {}  # scope -> (headers, expires_on)
+AAD_RETRY_INTERVAL = 600  # seconds to stay on the API key after Managed Identity / AAD fails
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, several times faster than the stdlib json module"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response without a str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
+class Agent:
+    """An agent used by one app: reused when an id is configured, otherwise created on first use"""
+
+    def __init__(self, definition, agent_id=None):
+        self.id = agent_id
+        self._body = orjson.dumps(definition)
+        self._lock = threading.Lock()
+
+    def get_id(self):
+        """Return the agent id, creating the agent if needed"""
+        if self.id:
+            return self.id
+
+        # Concurrent first requests must not each create an agent
+        with self._lock:
+            if self.id:
+                return self.id
+            url = f"{ENDPOINT}/assistants{API_QS}"
+            r = send_request("POST", url, headers=get_headers(), content=self._body, timeout=30)
+            r.raise_for_status()
+            self.id = orjson.loads(r.content)['id']
+            print(f"✅ Agent created: {self.id}")
+            return self.id
+
+
+def get_credential():
+    """Create the shared Azure credential on first use"""
+    global _credential
+    if _credential is None:
+        from azure.identity import DefaultAzureCredential
+        _credential = DefaultAzureCredential()
+    return _credential
+
+
+def get_headers():
+    """Get authorization headers for the Azure AI API, preferring Managed Identity / AAD"""
+    cached = _token_cache.get(TOKEN_SCOPE)
+    if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+        return cached[0]
+
+    api_key = os.getenv("AZURE_AI_API_KEY")
+    api_key_headers = {"api-key": api_key, "Content-Type": "application/json"} if api_key else None
+    # Only one caller probes the credential chain; with a usable fallback the rest don't queue behind it
+    if not _token_lock.acquire(blocking=not api_key):
+        return cached[0] if cached and cached[1] > time.time() else api_key_headers
+    try:
+        cached = _token_cache.get(TOKEN_SCOPE)
+        if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        try:
+            token = get_credential().get_token(TOKEN_SCOPE)
+        except Exception:
+            if not api_key:
+                raise RuntimeError("No Azure auth available. Set AZURE_AI_API_KEY or enable Managed Identity.")
+            # Use the API key and leave the credential chain alone for a while
+            _token_cache[TOKEN_SCOPE] = (api_key_headers, time.time() + TOKEN_REFRESH_MARGIN + AAD_RETRY_INTERVAL)
+            return api_key_headers
+        headers = {"Authorization": f"Bearer {token.token}", "Content-Type": "application/json"}
+        _token_cache[TOKEN_SCOPE] = (headers, token.expires_on)
+        return headers
+    finally:
+        _token_lock.release()
+
+
+def poll_delay(attempt):
+    """Exponential backoff with jitter, starting around 150ms and capped at 2s"""
+    return min(2.0, 0.15 * (2 ** attempt) * (1 + random.random() * 0.5))
+
+
+def retry_delay(attempt):
+    """Backoff before retrying a failed request: about 2s, 4s, 8s with up to 50% jitter"""
+    return 2 * (2 ** attempt) * (1 + random.random() * 0.5)
+
+
+def send_request(method, url, stream=False, **kwargs):
+    """Send a request, retrying transient failures with backoff
+
+    GETs are retried on any dropped connection or 5xx. Other methods may already have taken
+    effect (a second run, agent or thread), so they are only retried when the connection was
+    never made or the service throttled or refused the request.
+    """
+    if method == "GET":
+        retry_errors, retry_status = httpx.TransportError, RETRYABLE_STATUS
+    else:
+        retry_errors, retry_status = (httpx.ConnectError, httpx.ConnectTimeout), POST_RETRYABLE_STATUS
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = _client.send(_client.build_request(method, url, **kwargs), stream=stream)
+        except retry_errors:
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in retry_status or attempt == MAX_RETRIES:
+                return response
+            response.close()
+        time.sleep(retry_delay(attempt))
+
+
+def create_thread(messages=None):
+    """Create a new conversation thread, optionally seeded with messages"""
+    try:
+        body = orjson.dumps({"messages": messages}) if messages else _THREAD_CREATE_BODY
+        response = send_request("POST", THREADS_URL + API_QS, headers=get_headers(), content=body)
+
+        if response.status_code in [200, 201]:
+            thread_id = orjson.loads(response.content)['id']
+            print(f"✅ Thread created successfully: {thread_id}")
+            return thread_id
+        else:
+            print(f"❌ Error creating thread. Status: {response.status_code}")
+            print(f"❌ Response: {response.text}")
+            return None
+    except Exception as e:
+        print(f"💥 Exception in create_thread: {str(e)}")
+        return None
+
+
+def reply_cache_key(message):
+    """Normalized hash of a message, or None if it may hold personal details (emails, long numbers)"""
+    if '@' in message or re.search(r'\d{4,}', message):
+        return None
+    normalized = ' '.join(message.lower().split())
+    return hashlib.blake2b(normalized.encode()).hexdigest()
+
+
+def thread_signer():
+    """Signer for the thread tokens handed to clients, keyed by the app's secret key"""
+    return URLSafeSerializer(current_app.secret_key, salt='thread')
+
+
+def read_thread_token(thread_token):
+    """Return the thread id a token was issued for, or None if it's missing or forged"""
+    if not isinstance(thread_token, str):
+        return None
+    try:
+        return thread_signer().loads(thread_token)
+    except BadSignature:
+        return None
+
+
+def start_turn(thread_token, message, current=None):
+    """Resolve the thread for this turn, returning (thread_id, thread_token, reply_key, cached_reply)
+
+    The thread comes from a token the client got back from an earlier turn, else `current` (the
+    thread a WebSocket is already bound to), else the signed session. Raw thread ids from the
+    client are never trusted: tokens are signed with the app's secret key, so a client can only
+    continue threads this app started for it. Unlike the session cookie, which can't be updated
+    over a WebSocket, a token keeps the conversation going across reconnects.
+
+    Only a conversation's opening message is looked up in or added to the reply cache, since
+    later messages depend on earlier context. On a hit the new thread is seeded with the cached
+    exchange so follow-up questions still see it.
+    """
+    thread_id = read_thread_token(thread_token) or current or session.get('thread_id')
+    reply_key = cached_reply = None
+    if not thread_id:
+        reply_key = reply_cache_key(message)
+        if reply_key:
+            with _reply_cache_lock:
+                cached_reply = _reply_cache.get(reply_key)
+        seed = None
+        if cached_reply:
+            seed = [{"role": "user", "content": message}, {"role": "assistant", "content": cached_reply}]
+        thread_id = create_thread(seed)
+    if not thread_id:
+        return None, None, None, None
+    session['thread_id'] = thread_id
+    return thread_id, thread_signer().dumps(thread_id), reply_key, cached_reply
+
+
+def open_event_stream(url, headers, payload):
+    """POST a request whose reply is read incrementally as a text/event-stream"""
+    response = send_request("POST", url, stream=True, headers={**headers, "Accept": "text/event-stream"},
+                            content=orjson.dumps(payload), timeout=POLL_TIMEOUT)
+    if response.status_code not in [200, 201]:
+        # Load the error body so callers can report response.text
+        response.read()
+    return response
+
+
+def submit_tool_approvals(thread_id, run_id, required_action, headers, stream=False):
+    """Approve pending MCP tool calls, returning the submit response or None"""
+    # GA servers emit 'submit_tool_outputs'; older preview servers emit 'submit_tool_approval'.
+    # For MCP approvals both use the same endpoint, so one pass covers either shape.
+    details = required_action.get('submit_tool_outputs') or required_action.get('submit_tool_approval') or {}
+    tool_approvals = [
+        {"tool_call_id": tc["id"], "approve": True, "headers": {}}
+        for tc in details.get('tool_calls', [])
+        if tc.get('type') == 'mcp'
+    ]
+
+    if not tool_approvals:
+        print("No MCP tool calls to approve")
+        return None
+
+    submit_url = f"{THREADS_URL}/{thread_id}/runs/{run_id}/submit_tool_outputs{API_QS}"
+    payload = {"tool_approvals": tool_approvals}
+    if stream:
+        # Keep consuming the same run as a server-sent event stream
+        payload["stream"] = True
+        submit_response = open_event_stream(submit_url, headers, payload)
+    else:
+        submit_response = send_request("POST", submit_url, headers=headers, content=orjson.dumps(payload), timeout=30)
+    if submit_response.status_code != 200:
+        print(f"Error submitting tool approvals: {submit_response.text}")
+        return None
+    return submit_response
+
+
+def wait_for_run(thread_id, run_id, headers):
+    """Poll a run until it finishes and return the latest assistant message"""
+    # Poll for completion with exponential backoff
+    status_url = f"{THREADS_URL}/{thread_id}/runs/{run_id}{API_QS}"
+    # Only the newest message this run produced
+    messages_url = f"{THREADS_URL}/{thread_id}/messages{API_QS}&limit=1&order=desc&run_id={run_id}"
+    deadline = time.time() + POLL_TIMEOUT
+    attempt = 0
+    while time.time() < deadline:
+        status_response = send_request("GET", status_url, headers=headers)
+
+        if status_response.status_code == 200:
+            run_data = orjson.loads(status_response.content)
+            status = run_data['status']
+            if status == 'completed':
+                messages_response = send_request("GET", messages_url, headers=headers)
+
+                if messages_response.status_code == 200:
+                    messages = orjson.loads(messages_response.content)['data']
+                    if messages:
+                        return messages[0]['content'][0]['text']['value']
+                break
+            elif status == 'requires_action':
+                required_action = run_data.get('required_action') or {}
+                if not submit_tool_approvals(thread_id, run_id, required_action, headers):
+                    break
+                attempt = 0
+            elif status in ['failed', 'cancelled', 'expired']:
+                print(f"Run failed with status: {status}")
+                break
+        elif status_response.status_code not in RETRYABLE_STATUS:
+            print(f"Error polling run: {status_response.text}")
+            break
+
+        time.sleep(poll_delay(attempt))
+        attempt += 1
+
+    return None
+
+
+def iter_sse(response):
+    """Yield (event, data) pairs from a text/event-stream response"""
+    response.encoding = 'utf-8'
+    event, data = None, []
+    for line in response.iter_lines():
+        if line:
+            field, _, value = line.partition(':')
+            if field == 'event':
+                event = value.strip()
+            elif field == 'data':
+                data.append(value[1:] if value.startswith(' ') else value)
+            continue
+        if data:
+            yield event, '\n'.join(data)
+        event, data = None, []
+    if data:
+        yield event, '\n'.join(data)
+
+
+def stream_run(thread_id, agent_id, headers, message):
+    """Create a streaming run and yield assistant text deltas as they arrive
+
+    Returns True once the run has completed, False if it failed or was cut short.
+    """
+    run_url = f"{THREADS_URL}/{thread_id}/runs{API_QS}"
+    run_data = {
+        "assistant_id": agent_id,
+        # Add the user message as part of creating the run, saving a round trip
+        "additional_messages": [
+            {
+                "role": "user",
+                "content": message
+            }
+        ],
+        "stream": True
+    }
+
+    response = open_event_stream(run_url, headers, run_data)
+    if response.status_code not in [200, 201]:
+        print(f"Error creating run: {response.text}")
+        return False
+
+    run_id = None
+    streamed = ""
+    while response is not None:
+        next_response = None
+        try:
+            for event, data in iter_sse(response):
+                if event == 'done' or data == '[DONE]':
+                    break
+                payload = orjson.loads(data)
+                if event == 'thread.run.created':
+                    run_id = payload['id']
+                elif event == 'thread.message.delta':
+                    for part in payload['delta'].get('content', []):
+                        if part.get('type') == 'text' and part['text'].get('value'):
+                            streamed += part['text']['value']
+                            yield part['text']['value']
+                elif event == 'thread.run.requires_action':
+                    # Approving on the stream continues the run on a new event stream
+                    run_id = payload['id']
+                    required_action = payload.get('required_action') or {}
+                    next_response = submit_tool_approvals(thread_id, run_id, required_action, headers, stream=True)
+                    if next_response is None:
+                        return False
+                    break
+                elif event == 'thread.run.completed':
+                    return True
+                elif event in ['thread.run.failed', 'thread.run.cancelled', 'thread.run.expired']:
+                    print(f"Run failed with status: {payload.get('status')}")
+                    return False
+        finally:
+            response.close()
+        response = next_response
+
+    # The stream closed before the run finished; fall back to polling for the result
+    if run_id:
+        content = wait_for_run(thread_id, run_id, headers)
+        if content and content.startswith(streamed):
+            yield content[len(streamed):]
+            return True
+    return False
+
+
+def stream_events(thread_id, thread_token, agent_id, headers, message, reply_key=None, cached_reply=None):
+    """Yield the chat events for one turn: reply tokens, then an error or done marker"""
+    if cached_reply:
+        yield {'token': cached_reply}
+        yield {'done': True, 'thread_id': thread_id, 'thread_token': thread_token}
+        return
+
+    reply = []
+    run = stream_run(thread_id, agent_id, headers, message)
+    while True:
+        try:
+            delta = next(run)
+        except StopIteration as stop:
+            completed = stop.value
+            break
+        reply.append(delta)
+        yield {'token': delta}
+    if not reply:
+        yield {'error': 'Failed to get response from agent'}
+    elif not completed:
+        # Tokens already shown aren't the whole answer; say so rather than end as if it were
+        yield {'error': 'The agent stopped before finishing its reply'}
+    elif reply_key:
+        # Only a finished run's reply is reused
+        with _reply_cache_lock:
+            _reply_cache[reply_key] = ''.join(reply)
+    yield {'done': True, 'thread_id': thread_id, 'thread_token': thread_token}
+
+
+def run_chat_job(events, *turn):
+    """Feed one chat turn's events into the job queue, ending with None"""
+    try:
+        for event in stream_events(*turn):
+            events.put(event)
+    except Exception as e:
+        print(f"Chat job error: {e}")
+        events.put({'error': str(e)})
+    finally:
+        events.put(None)
+
+
+def create_chat_app(import_name, agent):
+    """Build the Flask app serving the chat page and its /chat, /events, /chat/stream and /ws routes"""
+    app = Flask(import_name)
+    app.json = OrjsonProvider(app)
+    # Signs the session cookie that holds each browser's thread ids.
+    # Set FLASK_SECRET_KEY so every process and restart accepts the same cookie.
+    app.secret_key = os.environ.get('FLASK_SECRET_KEY')
+    if not app.secret_key:
+        print("⚠️ FLASK_SECRET_KEY is not set: sessions are signed with a random per-process key, "
+              "so conversations reset on restart and other instances reject this one's cookies")
+        app.secret_key = os.urandom(32)
+    CORS(app)
+    sock = Sock(app)
+
+    @app.route('/')
+    def home():
+        """Serve the main chat interface"""
+        return send_from_directory('.', 'index.html')
+
+    @app.route('/chat', methods=['POST'])
+    def chat():
+        """Accept a chat message and run it in the background, returning a job id"""
+        try:
+            data = request.get_json()
+            message = data.get('message', '')
+
+            if not message:
+                return jsonify({'error': 'No message provided'}), 400
+
+            thread_id, thread_token, reply_key, cached_reply = start_turn(data.get('thread_token'), message)
+            if not thread_id:
+                return jsonify({'error': 'Failed to create conversation thread'}), 500
+
+            # Drop jobs nobody came back for
+            now = time.time()
+            for stale_id, (_, created_at) in list(_jobs.items()):
+                if now - created_at > JOB_TTL:
+                    _jobs.pop(stale_id, None)
+
+            # Hand the turn to a worker thread and answer right away
+            job_id = uuid.uuid4().hex
+            events = queue.Queue()
+            _jobs[job_id] = (events, now)
+            _pool.submit(run_chat_job, events, thread_id, thread_token, agent.get_id(), get_headers(), message,
+                         reply_key, cached_reply)
+
+            return jsonify({
+                'job_id': job_id,
+                'thread_id': thread_id,
+                'thread_token': thread_token
+            }), 202
+
+        except Exception as e:
+            print(f"Chat error: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/events/<job_id>')
+    def chat_events(job_id):
+        """Stream a background chat job's events as server-sent events"""
+        job = _jobs.get(job_id)
+        if not job:
+            return jsonify({'error': 'Unknown job'}), 404
+        events = job[0]
+
+        def generate():
+            try:
+                while True:
+                    event = events.get()
+                    if event is None:
+                        break
+                    yield b"data: " + orjson.dumps(event) + b"\n\n"
+            finally:
+                _jobs.pop(job_id, None)
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/chat/stream', methods=['POST'])
+    def chat_stream():
+        """Handle chat messages, streaming the reply as server-sent events"""
+        try:
+            data = request.get_json()
+            message = data.get('message', '')
+
+            if not message:
+                return jsonify({'error': 'No message provided'}), 400
+
+            thread_id, thread_token, reply_key, cached_reply = start_turn(data.get('thread_token'), message)
+            if not thread_id:
+                return jsonify({'error': 'Failed to create conversation thread'}), 500
+
+            agent_id = agent.get_id()
+            headers = get_headers()
+
+            def generate():
+                # The response has already started, so failures are reported as an event
+                try:
+                    for event in stream_events(thread_id, thread_token, agent_id, headers, message, reply_key, cached_reply):
+                        yield b"data: " + orjson.dumps(event) + b"\n\n"
+                except Exception as e:
+                    print(f"Chat stream error: {e}")
+                    yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+
+            return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @sock.route('/ws')
+    def chat_ws(ws):
+        """Handle chat messages over a WebSocket, streaming reply tokens back"""
+        # One connection carries every turn of the conversation
+        thread_id = session.get('thread_id')
+        while True:
+            raw = ws.receive()
+            try:
+                data = orjson.loads(raw)
+                message = data.get('message', '')
+            except (orjson.JSONDecodeError, AttributeError):
+                # Not JSON, or JSON that isn't an object
+                ws.send(orjson.dumps({'error': 'Invalid message'}).decode())
+                continue
+
+            if not message:
+                ws.send(orjson.dumps({'error': 'No message provided'}).decode())
+                continue
+
+            try:
+                # The session cookie can't be updated over a WebSocket, so the thread is tracked per connection
+                thread_id, thread_token, reply_key, cached_reply = start_turn(data.get('thread_token'), message, thread_id)
+                if not thread_id:
+                    ws.send(orjson.dumps({'error': 'Failed to create conversation thread'}).decode())
+                    continue
+
+                agent_id = agent.get_id()
+                headers = get_headers()
+
+                for event in stream_events(thread_id, thread_token, agent_id, headers, message, reply_key, cached_reply):
+                    ws.send(orjson.dumps(event).decode())
+
+            except Exception as e:
+                print(f"WebSocket chat error: {e}")
+                ws.send(orjson.dumps({'error': str(e)}).decode())
+
+    return app
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for serving the chat app
+Run with: gunicorn app:app  (or agent:app for the MCP agent)
+Set MCP_AGENT_ID (agent:app) or AZURE_AI_AGENT_ID (app:app) to an existing agent;
+otherwise each worker start creates a new one.
+"""
+
+import os
+
+# Port from environment variable (Azure App Service uses this)
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# gevent workers patch sockets so outbound calls to Azure yield while waiting on I/O,
+# letting one worker serve many concurrent chats
+worker_class = "gevent"
+# Chat jobs are held in worker memory and streamed back from /events by the same process,
+# so a second worker would answer half of those requests with "Unknown job".
+# Scale out with more instances behind sticky sessions (e.g. App Service ARR affinity) instead.
+workers = 1
+worker_connections = 200
+
+# Streamed runs can stay open for up to a minute
+timeout = 120
+
+
+def on_starting(server):
+    if server.cfg.workers > 1:
+        raise RuntimeError("Chat jobs are kept in process memory; run a single worker per instance")